@@ -1,38 +1,108 @@
+import json
 import os
-import yt_dlp
+import shutil
+import subprocess
+import sys
+from tempfile import NamedTemporaryFile
 from log import get_logger
 
 logger = get_logger(__name__)
 
-def download_youtube_audio(youtube_url, output_path) -> tuple[str, str]:
-    """Download audio from a YouTube URL and convert it to WAV format.
-    Returns the title of the video and the path to the WAV file.
+# YouTube throttles single connections, so fetch several ranges/fragments at once
+CONNECTIONS = 8
+# keep YouTube's native encoding, demucs decodes it directly
+AUDIO_FORMAT = 'bestaudio[ext=m4a]/bestaudio/best'
+
+def fetch_youtube_info(youtube_url) -> dict:
+    """Fetch the metadata (title, id...) of a YouTube URL without downloading it.
+    The result can be passed to download_youtube_audio to avoid a second lookup.
     """
+    import yt_dlp # slow to import, only needed once a download starts
+
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl: # type: ignore
+        logger.info(f"Fetching video info for YouTube URL: {youtube_url}")
+        return ydl.extract_info(youtube_url, download=False, process=False) # type: ignore
+
+def download_youtube_audio(youtube_url, output_path, info_dict=None) -> tuple[str, str]:
+    """Download the audio stream of a YouTube URL as is (usually M4A or Opus).
+    Returns the title of the video and the path to the audio file.
+    """
+    import yt_dlp
+
     ydl_opts = {
-        'format': 'bestaudio/best',
+        'format': AUDIO_FORMAT,
         # 'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
         'outtmpl': os.path.join(output_path, '%(id)s.%(ext)s'),
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'wav',
-            'preferredquality': '192',
-        }],
         'quiet': True,
         'no_warnings': True,
+        'concurrent_fragment_downloads': CONNECTIONS,
     }
+    if shutil.which('aria2c'):
+        ydl_opts['external_downloader'] = 'aria2c'
+        ydl_opts['external_downloader_args'] = {
+            'aria2c': ['-x', str(CONNECTIONS), '-s', str(CONNECTIONS), '-k', '1M', '--min-split-size=1M'],
+        }
 
     with yt_dlp.YoutubeDL(ydl_opts) as ydl: # type: ignore
         logger.info(f"Downloading audio from YouTube URL: {youtube_url}")
         
-        info_dict = ydl.extract_info(youtube_url, download=True)
+        if info_dict is None:
+            info_dict = ydl.extract_info(youtube_url, download=True)
+        else:
+            info_dict = ydl.process_ie_result(info_dict, download=True)
             
         video_title = info_dict.get("title", None)
-        video_id = info_dict.get("id", None)
         if not video_title:
             raise ValueError("Could not retrieve video title.")
-        wav_file_path = os.path.join(output_path, f"{video_id}.wav")
-        logger.info(f"Downloaded video title: {video_title} at {wav_file_path}")
-        return video_title, wav_file_path
+        audio_file_path = info_dict["requested_downloads"][0]["filepath"]
+        logger.info(f"Downloaded video title: {video_title} at {audio_file_path}")
+        return video_title, audio_file_path
+
+def stream_youtube_audio(youtube_url, samplerate, channels, info_dict=None) -> tuple[str, bytearray]:
+    """Decode the audio of a YouTube URL straight into memory, without writing the audio to disk.
+    yt-dlp's own downloader (concurrent fragments, throttling workarounds) pipes into ffmpeg.
+    Returns the title of the video and the audio as interleaved float32 little-endian PCM.
+    """
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL({'format': AUDIO_FORMAT, 'quiet': True, 'no_warnings': True}) as ydl: # type: ignore
+        logger.info(f"Streaming audio from YouTube URL: {youtube_url}")
+        if info_dict is None:
+            info_dict = ydl.extract_info(youtube_url, download=False)
+        else:
+            info_dict = ydl.process_ie_result(info_dict, download=False)
+        info_json = json.dumps(ydl.sanitize_info(info_dict))
+
+    video_title = info_dict.get("title", None)
+    if not video_title:
+        raise ValueError("Could not retrieve video title.")
+    with NamedTemporaryFile("w", suffix=".info.json") as info_file:
+        # hand the resolved formats over so the downloader does not look the video up again
+        info_file.write(info_json)
+        info_file.flush()
+        downloader = subprocess.Popen([
+            sys.executable, "-m", "yt_dlp", "--quiet", "--no-warnings",
+            "--load-info-json", info_file.name,
+            "--format", AUDIO_FORMAT,
+            "--concurrent-fragments", str(CONNECTIONS),
+            "--output", "-",
+        ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        decoder = subprocess.Popen([
+            "ffmpeg", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-f", "f32le", "-ac", str(channels), "-ar", str(samplerate),
+            "pipe:1",
+        ], stdin=downloader.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        downloader.stdout.close() # type: ignore # let ffmpeg see the end of the stream
+        # grown in place so the tensor built from it does not need another copy
+        pcm = bytearray()
+        while chunk := decoder.stdout.read(1 << 20): # type: ignore
+            pcm += chunk
+        errors = decoder.stderr.read().decode().strip() # type: ignore
+        if decoder.wait() != 0 or downloader.wait() != 0:
+            raise RuntimeError(f"could not stream the audio: {errors or f'yt-dlp exited with {downloader.returncode}'}")
+    logger.info(f"Streamed video title: {video_title} ({len(pcm)} bytes)")
+    return video_title, pcm
 
 if __name__ == "__main__":
     import sys
@@ -42,5 +112,5 @@ if __name__ == "__main__":
         print("Usage: python dl.py <youtube_url>")
         sys.exit(1)
     youtube_url = sys.argv[1]
-    wav_path = download_youtube_audio(youtube_url, output_dir)
-    print(f"Downloaded and extracted audio to: {wav_path}")
\ No newline at end of file
+    audio_path = download_youtube_audio(youtube_url, output_dir)
+    print(f"Downloaded audio to: {audio_path}")
\ No newline at end of file
@@ -1,46 +1,184 @@
+from contextlib import nullcontext
+from functools import lru_cache
 from pathlib import Path
-import demucs.separate
+from typing import Iterable
+from demucs.apply import apply_model, BagOfModels
+from demucs.audio import save_audio
+from demucs.pretrained import get_model
+from demucs.separate import load_track
+import torch
 from log import get_logger, suppress_stdout_stderr
+from separation import AUDIO_CHANNELS, MAX_SEGMENT, SAMPLERATE, STEMS
 from enum import Enum
 
 logger = get_logger(__name__)
 
+# rough htdemucs memory profile: one second of segment per 700 MB of free VRAM
+VRAM_PER_SEGMENT_SECOND = 700 * 1024 * 1024
+
 class Models(Enum):
     HTDEMUCS = "htdemucs"
     HTDEMUCS_FT = "htdemucs_ft"
 
 
-def extract_stems(input_file: Path, output_dir: Path, model: Models = Models.HTDEMUCS) -> dict[str, Path]:
+@lru_cache(maxsize=128)
+def _stem_path_items(base_dir: Path) -> tuple[tuple[str, Path], ...]:
+    return tuple((name, base_dir / f'{name}.wav') for name in STEMS)
 
-    logger.info(f"Extracting stems from {input_file} to {output_dir} using model {model.value}")
-    
-    with suppress_stdout_stderr():
-        demucs.separate.main([
-            "-n", model.value,
-            "-o", str(output_dir),
-            str(input_file)
-        ])
 
+def stem_paths(base_dir: Path) -> dict[str, Path]:
+    """Paths of the stem files in `base_dir`, computed without touching the disk."""
+    return dict(_stem_path_items(base_dir))
+
+
+def is_up_to_date(outputs: Iterable[Path], source: Path) -> bool:
+    """True if every file in `outputs` exists and is newer than `source`."""
+    source_mtime = source.stat().st_mtime
+    return all(output.exists() and output.stat().st_mtime >= source_mtime for output in outputs)
+
+
+def default_device() -> str:
+    """Pick the fastest available torch device: cuda, then mps, then cpu."""
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+# loaded models, kept resident on their device so repeated extractions skip
+# the weight load and the host to device copy
+_models: dict[tuple[Models, str], BagOfModels] = {}
+
+
+def load_model(model: Models, device: str) -> BagOfModels:
+    """Load the weights of `model` onto `device`, reusing them if already loaded."""
+    key = (model, device)
+    if key not in _models:
+        logger.info(f"Loading model {model.value} on {device}")
+        with suppress_stdout_stderr():
+            separator = get_model(model.value)
+        # apply_model moves each model of the bag to the device and back
+        # on every call unless it already lives there
+        _models[key] = separator.to(device)
+    return _models[key]
+
+
+def cuda_devices() -> list[str]:
+    """Names of all visible CUDA devices (cuda:0, cuda:1...)."""
+    return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+
+
+def default_segment(device: str) -> int:
+    """Largest segment length (in seconds) that fits the free memory of `device`."""
+    if not device.startswith("cuda"):
+        return MAX_SEGMENT
+    free, _ = torch.cuda.mem_get_info(device)
+    return max(1, min(MAX_SEGMENT, free // VRAM_PER_SEGMENT_SECOND))
+
+
+def half_precision(device: str):
+    """Autocast context running the model in half precision on `device`.
+
+    float16 on CUDA, bfloat16 on MPS. CPUs have no fast half path and keep float32.
+    """
+    device_type = torch.device(device).type
+    if device_type == "cuda":
+        return torch.autocast(device_type="cuda", dtype=torch.float16)
+    if device_type == "mps":
+        return torch.autocast(device_type="mps", dtype=torch.bfloat16)
+    return nullcontext()
+
+
+def extract_stems(input_file: Path, output_dir: Path, model: Models = Models.HTDEMUCS,
+                  device: str | None = None, segment: int | None = None,
+                  shifts: int = 1, overlap: float = 0.25, half: bool = False) -> dict[str, Path]:
+    """Separate `input_file` into vocals, drums, bass and other WAV stems.
+
+    When `input_file` is not a WAV (e.g. a YouTube M4A), the decoded mix is
+    saved next to the stems and returned as 'original', for players that only
+    read PCM.
+
+    `segment` bounds the memory used per chunk and defaults to what fits on the
+    device. Each extra shift adds a full pass over the track, and a lower
+    overlap (e.g. 0.1) means fewer chunks to process at a small quality cost.
+    `half` runs the model in half precision on GPUs, roughly halving its memory
+    traffic.
+    """
     base_dir = output_dir / model.value / input_file.stem
-    ext = input_file.suffix
-
-    res = {
-        'vocals': base_dir / f'vocals{ext}',
-        'drums': base_dir / f'drums{ext}',
-        'bass': base_dir / f'bass{ext}',
-        'other': base_dir / f'other{ext}'
-    }
+    res = stem_paths(base_dir)
+    decode_original = input_file.suffix.lower() != '.wav'
+    if decode_original:
+        res['original'] = base_dir / 'original.wav'
+    if is_up_to_date(res.values(), input_file):
+        logger.info(f"Stems in {base_dir} are up to date, skipping extraction")
+        return res
+
+    mix = load_track(input_file, AUDIO_CHANNELS, SAMPLERATE)
+    return separate(mix, base_dir, model, device=device, segment=segment, shifts=shifts,
+                    overlap=overlap, half=half, save_original=decode_original)
+
+
+def extract_stems_from_pcm(pcm: bytearray, output_dir: Path, name: str, model: Models = Models.HTDEMUCS,
+                           **kwargs) -> dict[str, Path]:
+    """Separate interleaved float32 PCM (SAMPLERATE, AUDIO_CHANNELS) into WAV stems.
+
+    The decoded mix is saved next to the stems and returned as 'original'.
+    Takes the same keyword arguments as extract_stems.
+    """
+    mix = torch.frombuffer(pcm, dtype=torch.float32).view(-1, AUDIO_CHANNELS).t()
+    base_dir = output_dir / model.value / name
+    return separate(mix, base_dir, model, save_original=True, **kwargs)
+
+
+def separate(mix: torch.Tensor, base_dir: Path, model: Models = Models.HTDEMUCS,
+             device: str | None = None, segment: int | None = None, shifts: int = 1,
+             overlap: float = 0.25, half: bool = False, save_original: bool = False) -> dict[str, Path]:
+    """Separate a decoded (channels, samples) mix into WAV stems in `base_dir`."""
+    if device is None:
+        device = default_device()
+    if segment is None:
+        segment = default_segment(device)
+
+    logger.info(f"Extracting stems to {base_dir} using model {model.value} on {device}")
+    
+    separator = load_model(model, device)
+    # demucs expects a normalized mix, same as demucs.separate
+    ref = mix.mean(0)
+    wav = (mix - ref.mean()) / ref.std()
+    try:
+        with half_precision(device) if half else nullcontext():
+            sources = apply_model(separator, wav[None], device=device, segment=segment,
+                                  shifts=shifts, overlap=overlap)[0]
+        sources = sources.float()
+    except torch.cuda.OutOfMemoryError:
+        # the GPU could not fit the track, fall back to the (slow) cpu path
+        logger.warning(f"Out of memory on {device}, retrying on cpu")
+        torch.cuda.empty_cache()
+        return separate(mix, base_dir, model, device="cpu", segment=segment, shifts=shifts,
+                        overlap=overlap, half=half, save_original=save_original)
+    sources *= ref.std()
+    sources += ref.mean()
+
+    res = stem_paths(base_dir)
+    base_dir.mkdir(parents=True, exist_ok=True)
+    # written first so the stems end up newer than the original
+    if save_original:
+        res['original'] = base_dir / 'original.wav'
+        save_audio(mix, res['original'], samplerate=separator.samplerate)
+    for source, name in zip(sources, separator.sources):
+        save_audio(source, res[name], samplerate=separator.samplerate)
     logger.info(f"Extracted stems: {res}")
     return res
 
 if __name__ == "__main__":
     import sys
     if len(sys.argv) != 3:
-        print("Usage: python extract.py <input_wav_file> <output_dir>")
+        print("Usage: python extract.py <input_audio_file> <output_dir>")
         sys.exit(1)
-    input_wav = Path(sys.argv[1])
+    input_audio = Path(sys.argv[1])
     output_directory = Path(sys.argv[2])
-    stems = extract_stems(input_wav, output_directory)
+    stems = extract_stems(input_audio, output_directory)
     print("Extracted stems:")
     for stem, path in stems.items():
         print(f"{stem}: {path}")
@@ -0,0 +1,60 @@
+"""Non-blocking keyboard input for the live mixer"""
+import os
+import selectors
+import sys
+import termios
+import time
+import tty
+from typing import Optional
+
+
+class KeyboardInput:
+    """Simplified keyboard input handler for Rich Live"""
+    
+    # Bytes of every key the mixer does not handle, stripped in one bytes.translate call
+    IGNORED_KEYS = bytes(sorted(set(range(256)) - set(b"qQsSrR 0123456789\x03")))
+    
+    def __init__(self):
+        self.old_settings = None
+        self.selector: Optional[selectors.BaseSelector] = None
+        
+    def __enter__(self):
+        if not sys.stdin.isatty():
+            return self
+        try:
+            self.old_settings = termios.tcgetattr(sys.stdin)
+            tty.setcbreak(sys.stdin.fileno())
+        except (termios.error, AttributeError):
+            self.old_settings = None
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sys.stdin, selectors.EVENT_READ)
+        return self
+        
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.selector:
+            self.selector.close()
+            self.selector = None
+        if self.old_settings:
+            try:
+                termios.tcsetattr(sys.stdin, termios.TCSADRAIN, self.old_settings)
+            except termios.error:
+                pass
+    
+    def drain_chars(self, timeout: float = 0.0) -> str:
+        """Wait up to `timeout` seconds for input, then return every character typed so far"""
+        chars = self._read(timeout)
+        while chars and (more := self._read(0)):
+            chars += more
+        return chars
+    
+    def _read(self, timeout: float) -> str:
+        """Read every pending byte at once, keeping only the keys the mixer handles"""
+        if self.selector is None:
+            time.sleep(timeout)
+            return ""
+        try:
+            if self.selector.select(timeout):
+                return os.read(sys.stdin.fileno(), 64).translate(None, self.IGNORED_KEYS).decode()
+        except (OSError, IOError):
+            pass
+        return ""
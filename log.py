@@ -1,24 +1,37 @@
 import logging
 import os
 import sys
+import threading
 from contextlib import contextmanager
+from functools import lru_cache
 from rich.logging import RichHandler
 from rich.console import Console
 
 # Create a console instance for rich
 console = Console()
 
+# IRMIX_DEBUG=1 enables debug logs and source paths (which cost a stack lookup per record)
+DEBUG = os.environ.get("IRMIX_DEBUG") == "1"
+
 # Configure rich logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=logging.DEBUG if DEBUG else logging.INFO,
     format="%(name)s - %(message)s",
     datefmt="[%X]",
-    handlers=[RichHandler(console=console, show_path=True, show_time=True)]
+    handlers=[RichHandler(console=console, show_path=DEBUG, show_time=True)]
 )
 
+# Keep chatty libraries out of the rich handler
+for library in ("demucs", "yt_dlp", "urllib3", "numba"):
+    logging.getLogger(library).setLevel(logging.WARNING)
+
 # Create logger for this module
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
+def _get_named_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
 def get_logger(name: str | None = None) -> logging.Logger:
     """Get a logger instance with the specified name.
     
@@ -30,22 +43,39 @@ def get_logger(name: str | None = None) -> logging.Logger:
     """
     if name is None:
         # Get the calling module's name
-        import inspect
-        frame = inspect.currentframe()
-        if frame and frame.f_back:
-            name = frame.f_back.f_globals.get('__name__', 'unknown')
+        name = sys._getframe(1).f_globals.get('__name__', 'unknown')
     
-    return logging.getLogger(name)
+    return _get_named_logger(name)
 
 @contextmanager
 def suppress_stdout_stderr():
+    """Silence stdout and stderr, including native code (torch, SDL, ffmpeg...)
+    writing to file descriptors 1 and 2 directly.
+
+    The redirection is process-wide, so it would also swallow the output and
+    errors of other threads (a rich spinner, a download): while any other
+    thread is running it does nothing.
+    """
+    if threading.active_count() > 1:
+        yield
+        return
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout_fd = os.dup(1)
+    saved_stderr_fd = os.dup(2)
     with open(os.devnull, 'w') as devnull:
         old_stdout = sys.stdout
         old_stderr = sys.stderr
         sys.stdout = devnull
         sys.stderr = devnull
+        os.dup2(devnull.fileno(), 1)
+        os.dup2(devnull.fileno(), 2)
         try:
             yield
         finally:
+            os.dup2(saved_stdout_fd, 1)
+            os.dup2(saved_stderr_fd, 2)
+            os.close(saved_stdout_fd)
+            os.close(saved_stderr_fd)
             sys.stdout = old_stdout
             sys.stderr = old_stderr
@@ -5,14 +5,17 @@ A simple tool to extract stems from YouTube videos and mix them live.
 """
 
 import argparse
+import os
+import re
 import sys
-import select
-import termios
-import tty
 import time
 import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Optional
 
 from rich.console import Console
 from rich.panel import Panel
@@ -22,55 +25,69 @@ from rich.align import Align
 from rich.text import Text
 from rich import box
 
-from song import Song
-from mixer import TrackMixer
+from keyboard_input import KeyboardInput
+from log import console
+from separation import MAX_SEGMENT
 
+# song, mixer and extract pull in torch, demucs, yt_dlp and sounddevice: they are
+# imported where needed so --help and --list-songs start instantly
+if TYPE_CHECKING:
+    from song import Song
+    from mixer import TrackMixer
+
+
+YOUTUBE_URL_PATTERN = re.compile(
+    r"youtube\.com/(?:watch|embed/|v/)|youtu\.be/",
+    re.IGNORECASE
+)
 
-class KeyboardInput:
-    """Simplified keyboard input handler for Rich Live"""
-    
-    def __init__(self):
-        self.old_settings = None
-        
-    def __enter__(self):
-        if not sys.stdin.isatty():
-            return self
-        try:
-            self.old_settings = termios.tcgetattr(sys.stdin)
-            tty.setcbreak(sys.stdin.fileno())
-        except (termios.error, AttributeError):
-            self.old_settings = None
-        return self
-        
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.old_settings:
-            try:
-                termios.tcsetattr(sys.stdin, termios.TCSADRAIN, self.old_settings)
-            except termios.error:
-                pass
-    
-    def get_char(self) -> Optional[str]:
-        """Get a single character if available (non-blocking with faster polling)"""
-        if not sys.stdin.isatty():
-            return None
-        try:
-            if select.select([sys.stdin], [], [], 0.01) == ([sys.stdin], [], []):
-                char = sys.stdin.read(1)
-                if char.lower() in 'qsr ' or char.isdigit() or char == '\x03':
-                    return char
-        except (OSError, IOError):
-            pass
-        return None
+
+class RefreshTier(Enum):
+    """Seconds between two redraws of the live mixer, depending on activity"""
+    FOCUSED = 1 / 60    # a key was just pressed
+    VISIBLE = 0.1       # playback is progressing
+    BACKGROUND = 0.5    # paused or stopped
 
 
 class LiveMixer:
     """Rich-based live mixing interface with simple table display"""
     
-    def __init__(self, mixer: TrackMixer):
+    # Keys pressed within this many seconds keep the display in the FOCUSED tier
+    FOCUS_WINDOW = 0.5
+    # (text, style) of the status and volume cells of a muted or active stem
+    MUTED_CELLS = (("MUTED", "red"), ("0.0", "dim"))
+    ACTIVE_STATUS = ("ACTIVE", "green")
+    # (text, style) of the panel title for each playback status value
+    STATUS_TITLES = {
+        "playing": ("Status: PLAYING", "bold green"),
+        "paused": ("Status: PAUSED", "bold yellow"),
+        "stopped": ("Status: STOPPED", "bold red"),
+    }
+    # DEC mode 2026: terminals that support it draw a whole frame at once, others ignore it
+    BEGIN_SYNC = "\x1b[?2026h"
+    END_SYNC = "\x1b[?2026l"
+    
+    def __init__(self, mixer: "TrackMixer", console: Console = console):
         self.mixer = mixer
         self.running = False
-        self.stems = [track for track in mixer.list_tracks() if track != 'original']
-        self.console = Console()
+        # Fixed for the whole session: the stem of each number key, in order
+        self.stems = tuple(track for track in mixer.list_tracks() if track != 'original')
+        self.console = console
+        # Cells that change with the mixer state, updated in place by update_display
+        self._status_cells: dict[str, Text] = {}
+        self._volume_cells: dict[str, Text] = {}
+        self._status_title = Text()
+        self._last_size = None
+        # Set when the mixer state may have changed and the display needs a sync
+        self._dirty = True
+        # Only a mute toggle changes the stem rows, other syncs skip them
+        self._stems_dirty = True
+        # Mirror of the stems' mute state, flipped by the mute keys instead of queried every sync
+        self._mute_state = {stem: mixer.is_muted(stem) for stem in self.stems}
+        self._last_render = 0.0
+        self._last_input = 0.0
+        mixer.on_status_change = self._on_status_change
+        self.panel = self.create_display()
         
     def create_display(self) -> Panel:
         """Create the main display table"""
@@ -83,17 +100,14 @@ class LiveMixer:
         
         # Add stem rows
         for i, stem in enumerate(self.stems, 1):
-            muted = self.mixer.is_muted(stem)
-            volume = self.mixer.get_volume(stem)
-            
-            status = "[red]MUTED[/]" if muted else "[green]ACTIVE[/]"
-            volume_text = f"{volume:.1f}" if not muted else "[dim]0.0[/]"
+            self._status_cells[stem] = Text()
+            self._volume_cells[stem] = Text()
             
             table.add_row(
                 f"[cyan]{i}[/]",
                 stem.replace("_", " ").title(),
-                status,
-                volume_text
+                self._status_cells[stem],
+                self._volume_cells[stem]
             )
         
         # Add controls info
@@ -106,36 +120,69 @@ class LiveMixer:
             "[cyan]Q[/]=Quit"
         )
         
-        # Status info
-        status = self.mixer.status.value.upper()
-        status_color = "green" if status == "PLAYING" else "yellow" if status == "PAUSED" else "red"
-        status_text = Text(f"Status: {status}", style=f"bold {status_color}")
-        
         # Combine everything in a panel
         content = Align.center(table)
         panel = Panel(
             content,
             subtitle=controls,
             subtitle_align="center",
-            title=status_text,
+            title=self._status_title,
             title_align="center",
             border_style="bright_blue",
             padding=(1, 2)
         )
         
+        self.update_display()
         return panel
+    
+    def update_display(self) -> bool:
+        """Sync the display cells with the mixer state. Returns True if anything changed."""
+        changed = False
+        for stem in self.stems if self._stems_dirty else ():
+            if self._mute_state[stem]:
+                status, volume_text = self.MUTED_CELLS
+            else:
+                status, volume_text = self.ACTIVE_STATUS, (f"{self.mixer.get_volume(stem):.1f}", "")
+            changed |= self._set_cell(self._status_cells[stem], *status)
+            changed |= self._set_cell(self._volume_cells[stem], *volume_text)
+        
+        # Status info
+        changed |= self._set_cell(self._status_title, *self.STATUS_TITLES[self.mixer.status.value])
+        
+        # A resized terminal needs a redraw too
+        size = self.console.size
+        if size != self._last_size:
+            self._last_size = size
+            changed = True
+        
+        self._dirty = False
+        self._stems_dirty = False
+        return changed
+    
+    @staticmethod
+    def _set_cell(cell: Text, text: str, style: str) -> bool:
+        """Update a cell in place. Returns True if it changed."""
+        if cell.plain == text and cell.style == style:
+            return False
+        cell.plain = text
+        cell.style = style
+        return True
         
     def handle_key(self, char: str) -> bool:
         """Handle keyboard input. Returns True if should quit."""
         if char.lower() == 'q' or char == '\x03':  # q or Ctrl+C
             return True
         elif char == ' ':  # Space bar
-            if self.mixer.status.value == 'playing':
+            status = self.mixer.status.value
+            if status == 'playing':
                 self.mixer.pause()
-            elif self.mixer.status.value == 'paused':
+            elif status == 'paused':
                 self.mixer.resume()
             else:
+                # playing from a stop resets the mix to the original track
                 self.mixer.play()
+                self._mute_state = {stem: self.mixer.is_muted(stem) for stem in self.stems}
+                self._stems_dirty = True
         elif char.lower() == 's':
             self.mixer.stop()
         elif char.lower() == 'r':
@@ -145,8 +192,22 @@ class LiveMixer:
             if 1 <= stem_num <= len(self.stems):
                 stem_name = self.stems[stem_num - 1]
                 self.mixer.toggle_mute(stem_name)
+                self._mute_state[stem_name] = not self._mute_state[stem_name]
+                self._stems_dirty = True
         
         return False
+    
+    def _on_status_change(self, status) -> None:
+        """Mark the display for a sync when playback starts, pauses or stops"""
+        self._dirty = True
+    
+    def refresh_tier(self) -> RefreshTier:
+        """Pick the redraw rate from the last key press and the playback status"""
+        if time.monotonic() - self._last_input < self.FOCUS_WINDOW:
+            return RefreshTier.FOCUSED
+        if self.mixer.status.value == 'playing':
+            return RefreshTier.VISIBLE
+        return RefreshTier.BACKGROUND
         
     def run(self):
         """Run the live mixer interface"""
@@ -160,7 +221,7 @@ class LiveMixer:
             self.mixer.play()
             
             with Live(
-                self.create_display(),
+                self.panel,
                 refresh_per_second=10,
                 auto_refresh=False,
                 console=self.console,
@@ -169,15 +230,35 @@ class LiveMixer:
                 with KeyboardInput() as kb:
                     while self.running:
                         try:
-                            # Clear and update display
-                            live.update(self.create_display(), refresh=True)
+                            interval = self.refresh_tier().value
+                            timeout = interval
+                            if self._dirty:
+                                # Only redraw when the mixer state or terminal size changed,
+                                # at most once per interval of the current tier
+                                wait = self._last_render + interval - time.monotonic()
+                                if wait > 0:
+                                    timeout = wait
+                                elif self.update_display():
+                                    self.console.file.write(self.BEGIN_SYNC)
+                                    live.refresh()
+                                    self.console.file.write(self.END_SYNC)
+                                    self.console.file.flush()
+                                    self._last_render = time.monotonic()
                             
-                            # Check for keyboard input with faster polling
-                            char = kb.get_char()
-                            if char and self.handle_key(char):
-                                break
-                                    
-                            time.sleep(0.01)  # Faster polling for more responsive input
+                            # Sleep until a key is pressed instead of polling, then apply
+                            # the whole burst of keys before the next redraw
+                            chars = kb.drain_chars(timeout=timeout)
+                            for char in chars:
+                                if self.handle_key(char):
+                                    self.running = False
+                                    break
+                            if chars:
+                                self._last_input = time.monotonic()
+                                self._dirty = True
+                            else:
+                                # Idle: status changes mark the display themselves,
+                                # only the terminal size may have changed
+                                self._dirty |= self.console.size != self._last_size
                             
                         except KeyboardInterrupt:
                             break
@@ -185,27 +266,42 @@ class LiveMixer:
         finally:
             self.running = False
             self.mixer.stop()
+            self.mixer.on_status_change = None
             # Re-enable logging after live interface
             logging.disable(logging.NOTSET)
             self.console.clear()
             self.console.print("\n[bold blue]🎵 Mixer stopped. Goodbye![/]\n")
 
 
-def extract_and_mix(youtube_url: str, extract_only: bool = False):
+def extract_and_mix(youtube_url: str, extract_only: bool = False, device: Optional[str] = None,
+                    segment: Optional[int] = None, shifts: int = 1, overlap: float = 0.25,
+                    half: bool = False):
     """Extract stems from YouTube URL and optionally start live mixer"""
-    console = Console()
+    from song import Song
+    from mixer import TrackMixer
+    from extract import Models, default_device, load_model
+    from dl import fetch_youtube_info
     
     try:
         console.print(f"\n[bold blue]🔗 Processing YouTube URL:[/] {youtube_url}")
         
-        # Download audio
         with console.status("[bold green]📥 Downloading audio...\n", spinner="dots"):
-            song = Song.from_yt_url(youtube_url)
+            info = fetch_youtube_info(youtube_url)
+            # Load the separation model while the audio downloads, unless the stems are cached
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                model = None
+                if not Song.is_separated(Song.yt_path(info)):
+                    if device is None:
+                        device = default_device()
+                    model = pool.submit(load_model, Models.HTDEMUCS, device)
+                song = Song.from_yt_url(youtube_url, info)
+                if model is not None:
+                    model.result()
         console.print(f"[green]✓[/] Downloaded: [bold]{song.title}[/]")
         
         # Extract stems
         console.print("[bold yellow]🎵 Extracting stems (this may take a few minutes)...[/]")
-        song.extract_stems()
+        song.extract_stems(device=device, segment=segment, shifts=shifts, overlap=overlap, half=half)
         console.print("[green]✓[/] Stems extracted successfully!")
         
         # If extract_only is True, stop here
@@ -234,7 +330,8 @@ def extract_and_mix(youtube_url: str, extract_only: bool = False):
 
 def mix_existing(song_path: str):
     """Mix existing song directory"""
-    console = Console()
+    from song import Song
+    from mixer import TrackMixer
     
     try:
         path = Path(song_path)
@@ -264,36 +361,152 @@ def mix_existing(song_path: str):
         sys.exit(1)
 
 
+def read_batch(batch_file: str) -> list[str]:
+    """Read one YouTube URL or song path per line ('-' reads stdin), skipping blanks and # comments"""
+    if batch_file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        try:
+            lines = Path(batch_file).read_text().splitlines()
+        except (OSError, UnicodeDecodeError) as e:
+            console.print(f"[red]✗ Error:[/] Could not read batch file: {e}")
+            sys.exit(1)
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
+
+def load_song(url_or_path: str) -> "Song":
+    """Download a song from a YouTube URL or load it from a song directory"""
+    from song import Song
+    
+    if is_youtube_url(url_or_path):
+        return Song.from_yt_url(url_or_path)
+    return Song.from_path(Path(url_or_path))
+
+
+def prefetch_song(url_or_path: str) -> Callable[[], "Song"]:
+    """Load a batch song ahead of time, returning a call that gives the song"""
+    from song import Song
+    from dl import fetch_youtube_info
+    
+    if is_youtube_url(url_or_path):
+        info = fetch_youtube_info(url_or_path)
+        if Song.streams(info):
+            # a streamed song is held in memory as decoded PCM (~21 MB per minute):
+            # only its info is fetched ahead, the stream waits for its turn
+            return partial(Song.from_yt_url, url_or_path, info)
+        song = Song.from_yt_url(url_or_path, info)
+    else:
+        song = Song.from_path(Path(url_or_path))
+    return lambda: song
+
+
+# GPU of the current batch worker process, set by _init_gpu_worker
+_worker_device: Optional[str] = None
+
+
+def _init_gpu_worker(devices: multiprocessing.Queue):
+    """Pin a batch worker process to the next free GPU and load the model there"""
+    from extract import Models, load_model
+    
+    global _worker_device
+    _worker_device = devices.get()
+    load_model(Models.HTDEMUCS, _worker_device)
+
+
+def _extract_on_gpu_worker(url_or_path: str, options: dict) -> tuple[str, str, Optional[str]]:
+    """Extract one song in a batch worker. Returns (input, song title, error message)"""
+    try:
+        song = load_song(url_or_path)
+        song.extract_stems(device=_worker_device, **options)
+        return url_or_path, song.title, None
+    except Exception as e:
+        return url_or_path, "", str(e)
+
+
+def extract_batch(inputs: list[str], device: Optional[str] = None, segment: Optional[int] = None,
+                  shifts: int = 1, overlap: float = 0.25, half: bool = False):
+    """Download and extract stems for many URLs/song paths, loading the model only once per device"""
+    from extract import Models, cuda_devices, default_device, load_model
+    
+    options = {"segment": segment, "shifts": shifts, "overlap": overlap, "half": half}
+    failed = []
+    
+    gpus = cuda_devices() if device in (None, "cuda") else []
+    if len(gpus) > 1 and len(inputs) > 1:
+        # One worker process per GPU, each pulling the next song as soon as it is done
+        console.print(f"[bold cyan]🧠 Spreading {len(inputs)} songs over {len(gpus)} GPUs[/]")
+        context = multiprocessing.get_context("spawn")
+        devices = context.Queue()
+        for gpu in gpus:
+            devices.put(gpu)
+        with context.Pool(len(gpus), initializer=_init_gpu_worker, initargs=(devices,)) as pool:
+            results = pool.imap_unordered(partial(_extract_on_gpu_worker, options=options), inputs)
+            for i, (url_or_path, title, error) in enumerate(results, 1):
+                if error is None:
+                    console.print(f"[green]✓[/] [{i}/{len(inputs)}] Stems extracted for [bold]{title}[/]")
+                else:
+                    console.print(f"[red]✗[/] [{i}/{len(inputs)}] {url_or_path}: {error}")
+                    failed.append(url_or_path)
+    elif inputs:
+        if device is None:
+            device = default_device()
+        
+        # no spinner: its thread would keep load_model from silencing the weight download
+        console.print(f"[bold cyan]🧠 Loading separation model on {device}...[/]")
+        load_model(Models.HTDEMUCS, device)
+        
+        # Download the next song while the current one is being separated
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(prefetch_song, inputs[0])
+            for i, url_or_path in enumerate(inputs, 1):
+                console.print(f"\n[bold blue]🔗 [{i}/{len(inputs)}][/] {url_or_path}")
+                loading = pending
+                if i < len(inputs):
+                    pending = pool.submit(prefetch_song, inputs[i])
+                try:
+                    with console.status("[bold green]📥 Loading song...", spinner="dots"):
+                        song = loading.result()()
+                    
+                    with console.status(f"[bold yellow]🎵 Extracting stems for {song.title}...", spinner="dots"):
+                        song.extract_stems(device=device, **options)
+                    console.print(f"[green]✓[/] Stems extracted for [bold]{song.title}[/]")
+                except Exception as e:
+                    console.print(f"[red]✗ Error:[/] {e}")
+                    failed.append(url_or_path)
+    
+    console.print(f"\n[bold]Done:[/] {len(inputs) - len(failed)}/{len(inputs)} songs extracted")
+    if failed:
+        console.print("[red]Failed:[/]")
+        for url_or_path in failed:
+            console.print(f"  [red]•[/] {url_or_path}")
+        sys.exit(1)
+
+
 def list_available_songs():
     """List available songs in the songs directory"""
-    console = Console()
     songs_dir = Path("songs")
     
     if not songs_dir.exists():
         console.print("[red]📁 Songs directory does not exist[/]")
         return
         
-    songs = [d.name for d in songs_dir.iterdir() if d.is_dir()]
+    # scandir entries know their type from readdir, no stat per song
+    with os.scandir(songs_dir) as entries:
+        songs = sorted(entry.name for entry in entries if entry.is_dir())
     if not songs:
         console.print("[yellow]📁 No songs found in songs directory[/]")
         return
         
     console.print("\n[bold blue]🎵 Available songs:[/]")
-    for song in sorted(songs):
+    for song in songs:
         console.print(f"  [green]•[/] {song}")
     console.print()
 
 
 def is_youtube_url(url_or_path: str) -> bool:
     """Check if the input is a YouTube URL"""
-    youtube_patterns = [
-        "youtube.com/watch",
-        "youtu.be/",
-        "youtube.com/embed/",
-        "youtube.com/v/",
-        "m.youtube.com/watch"
-    ]
-    return any(pattern in url_or_path.lower() for pattern in youtube_patterns)
+    # m.youtube.com/watch is covered by youtube.com/watch
+    return YOUTUBE_URL_PATTERN.search(url_or_path) is not None
 
 
 def main():
@@ -309,6 +522,12 @@ Examples:
   # Only download audio and extract stems (no mixer)
   python main.py https://www.youtube.com/watch?v=VIDEO_ID --extract
   
+  # Force stem separation on the CPU
+  python main.py https://www.youtube.com/watch?v=VIDEO_ID --device cpu
+  
+  # Extract stems for every URL in a file (one per line, - for stdin)
+  python main.py --batch urls.txt
+  
   # Mix existing stem folder
   python main.py songs/SONG_NAME
   
@@ -329,6 +548,43 @@ Examples:
         help="Extract-only mode: download audio and extract stems without launching mixer"
     )
     
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Extract stems for every YouTube URL or song path listed in FILE (one per line, - for stdin)"
+    )
+    
+    parser.add_argument(
+        "--device",
+        help="Torch device for stem separation (cuda, mps, cpu). Auto-detected by default"
+    )
+    
+    parser.add_argument(
+        "--segment",
+        type=int,
+        help="Separation chunk length in seconds (max 7). Lower it if the GPU runs out of memory"
+    )
+    
+    parser.add_argument(
+        "--shifts",
+        type=int,
+        default=1,
+        help="Random shifts averaged per chunk. Improves quality, each shift adds a full pass (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=0.25,
+        help="Overlap between separation chunks. Lower is faster (default: 0.25)"
+    )
+    
+    parser.add_argument(
+        "--half",
+        action="store_true",
+        help="Run stem separation in half precision on GPUs (faster, uses less memory)"
+    )
+    
     parser.add_argument(
         "--list-songs",
         action="store_true",
@@ -337,11 +593,31 @@ Examples:
     
     args = parser.parse_args()
     
+    # Reject tuning values demucs would only fail on after the download
+    if args.segment is not None and not 1 <= args.segment <= MAX_SEGMENT:
+        parser.error(f"--segment must be between 1 and {MAX_SEGMENT}")
+    if args.shifts < 1:
+        parser.error("--shifts must be at least 1")
+    if not 0 <= args.overlap < 1:
+        parser.error("--overlap must be at least 0 and lower than 1")
+    
     # Handle list songs option
     if args.list_songs:
         list_available_songs()
         return
     
+    # Handle batch extraction
+    if args.batch:
+        extract_batch(
+            read_batch(args.batch),
+            device=args.device,
+            segment=args.segment,
+            shifts=args.shifts,
+            overlap=args.overlap,
+            half=args.half
+        )
+        return
+    
     # Require URL or path for other operations
     if not args.url_or_path:
         parser.print_help()
@@ -350,7 +626,15 @@ Examples:
     # Determine if input is YouTube URL or local path
     if is_youtube_url(args.url_or_path):
         # YouTube URL - download and extract stems
-        extract_and_mix(args.url_or_path, extract_only=args.extract)
+        extract_and_mix(
+            args.url_or_path,
+            extract_only=args.extract,
+            device=args.device,
+            segment=args.segment,
+            shifts=args.shifts,
+            overlap=args.overlap,
+            half=args.half
+        )
     else:
         # Local path - mix existing stems
         if args.extract:
@@ -1,31 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path
-from log import get_logger, suppress_stdout_stderr
-with suppress_stdout_stderr():
-    import pygame
+from typing import Callable
 import os
 
+import numpy as np
+import sounddevice as sd
+import soundfile as sf
+from numba import njit
+
+from log import get_logger
 from song import Song, ORIGINAL
 
 logger = get_logger(__name__)
 
+# tracks are kept as 16-bit PCM (half the memory of float32), scaled back to [-1, 1) when mixed
+INT16_SCALE = 1 / 32768
+# gain changes are ramped over this many samples (~1.5 ms) so mutes do not click
+RAMP_SAMPLES = 64
+
+def _wav_data_offset(path) -> int | None:
+    """Byte offset of the samples in a RIFF/WAVE file, None if it has no data chunk"""
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if header[:4] != b'RIFF' or header[8:] != b'WAVE':
+            return None
+        while len(chunk := f.read(8)) == 8:
+            size = int.from_bytes(chunk[4:], 'little')
+            if chunk[:4] == b'data':
+                return f.tell()
+            f.seek(size + (size & 1), os.SEEK_CUR)  # chunks are word aligned
+    return None
+
+# nogil: the UI thread keeps running while the audio thread mixes
+@njit(fastmath=True, cache=True, nogil=True)
+def _mix_block(out, stems, gains, targets, pos, n):
+    """out[:n] = sum of gains[t] * stems[t][pos:pos + n] over all tracks t, clipped to [-1, 1], out[n:] = 0.
+    Each gain moves linearly to its target over RAMP_SAMPLES samples and is updated in place.
+    Ramp, mix and clip are fused: every sample is read once and every output written once.
+    """
+    for i in range(out.shape[0]):
+        for c in range(out.shape[1]):
+            acc = 0.0
+            if i < n:
+                for track in range(len(stems)):
+                    gain = gains[track]
+                    target = targets[track]
+                    data = stems[track]
+                    if (gain == 0.0 and target == 0.0) or pos + i >= data.shape[0]:
+                        continue  # silent tracks are not read, shorter tracks end early
+                    g = target if i >= RAMP_SAMPLES else gain + (target - gain) * (i + 1) / RAMP_SAMPLES
+                    acc += g * data[pos + i, c]
+                acc *= INT16_SCALE
+                if acc > 1.0:
+                    acc = 1.0
+                elif acc < -1.0:
+                    acc = -1.0
+            out[i, c] = acc
+    for track in range(len(stems)):
+        gain = gains[track]
+        gains[track] = targets[track] if n >= RAMP_SAMPLES else gain + (targets[track] - gain) * n / RAMP_SAMPLES
+
 class PlaybackStatus(Enum):
     STOPPED = "stopped"
     PLAYING = "playing"
     PAUSED = "paused"
 
-class Track:
-    def __init__(self, name: str, sound: pygame.mixer.Sound, channel: pygame.mixer.Channel):
-        self.name = name
-        self.sound = sound
-        self.channel = channel
-
 class TrackMixer:
-    def __init__(self, frequency=44100, channels=2, buffer=512):
-        pygame.mixer.init(frequency=frequency, channels=channels, buffer=buffer)
-        self.tracks: dict[str, Track] = {}   # name -> Track
-        self.volumes: dict[str, float] = {}  # name -> volume (0.0 to 1.0)
-        self.status = PlaybackStatus.STOPPED
+    """Mix tracks in sync by summing them into a single output stream, one block at a time."""
+    def __init__(self, frequency=44100, channels=2, buffer=None, latency_ms=12):
+        if buffer is None:
+            # largest power of two block that fits in the latency budget, 512 at 44.1 kHz / 12 ms
+            buffer = 1 << max(6, (frequency * latency_ms // 1000).bit_length() - 1)
+        self.frequency = frequency
+        self.channels = channels
+        self.tracks: dict[str, np.ndarray] = {}  # name -> (n_samples, channels) int16 audio
+        # called with the new status whenever playback starts, pauses or stops
+        self.on_status_change: Callable[[PlaybackStatus], None] | None = None
+        self._status = PlaybackStatus.STOPPED
+        # tracks in index order for the audio callback, and the length of the longest one
+        self._stems: tuple[np.ndarray, ...] | None = None
+        self._length = 0
+        # gain of each track, 0.0 when muted, edited by the mute and volume methods
+        self._vol_vec = np.zeros(0, dtype=np.float32)
+        # per-track state as arrays indexed by track position
+        self._names: list[str] = []
+        self._index: dict[str, int] = {}  # name -> position in _names, _stems, _volumes and _vol_vec
+        self._volumes = np.zeros(0, dtype=np.float32)  # volume set by the user (0.0 to 1.0)
+        self._original: int | None = None  # position of the original track, compared instead of names
+        # bit i set when track i is muted, and the bits of every track but the original
+        self._muted_mask = 0
+        self._stem_mask = 0
+        # target gains read by the audio callback: a snapshot of _vol_vec swapped in
+        # as a whole, so a block never mixes half-applied changes
+        self._targets = self._vol_vec.copy()
+        # gains the audio callback is currently applying, ramping towards _targets
+        self._gains = np.zeros(0, dtype=np.float32)
+        self._pos = 0  # next sample to play, only moved by the audio callback while playing
+        self._seek: int | None = None  # position requested by rewind_all, applied on the next block
+        self._stream = sd.OutputStream(
+            samplerate=frequency, channels=channels, blocksize=buffer,
+            latency=latency_ms / 1000, dtype='float32', callback=self._callback,
+        )
+
+    @property
+    def status(self) -> PlaybackStatus:
+        return self._status
+
+    @status.setter
+    def status(self, status: PlaybackStatus):
+        if status == self._status:
+            return
+        self._status = status
+        if self.on_status_change is not None:
+            self.on_status_change(status)
 
     def add_track(self, path, name=None):
         """
@@ -35,68 +123,132 @@ class TrackMixer:
         """
         if name is None:
             name = os.path.basename(path)
+        self._add_decoded(name, self._decode(path))
+
+    def _decode(self, path) -> np.ndarray:
+        """Read an audio file as (n_samples, channels) int16 at the mixer frequency"""
+        info = sf.info(path)
+        if (info.format, info.subtype, info.samplerate, info.channels) == ('WAV', 'PCM_16', self.frequency, self.channels):
+            offset = _wav_data_offset(path)
+            if offset is not None:
+                # the stems written by demucs already have the mixer layout: map them instead of
+                # reading them, pages are loaded (sequentially, with readahead) as playback reaches them
+                return np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(info.frames, self.channels))
+        data, samplerate = sf.read(path, dtype='int16', always_2d=True)
+        if samplerate != self.frequency:
+            data = self._resample(data, samplerate)
+        if data.shape[1] != self.channels:
+            # mono (or surround) files are mixed down then spread over the output channels
+            data = np.repeat(data.mean(axis=1, keepdims=True), self.channels, axis=1).astype(np.int16)
+        return data
 
-        sound = pygame.mixer.Sound(path)
-        channel = pygame.mixer.Channel(len(self.tracks))  # unique channel per track
-        self.tracks[name] = Track(name, sound, channel)
-        self.volumes[name] = 1.0  # default volume
+    def _add_decoded(self, name: str, data: np.ndarray):
+        # mapped and decoded tracks must share one array type for the mix kernel
+        data.flags.writeable = False
+        self.tracks[name] = data
+        self._index[name] = len(self._names)
+        self._names.append(name)
+        self._volumes = np.append(self._volumes, np.float32(1.0))  # default volume
+        if name == ORIGINAL:
+            self._original = self._index[name]
+        else:
+            self._stem_mask |= 1 << self._index[name]
+        self._vol_vec = np.append(self._vol_vec, np.float32(1.0))
+        self._publish()
+        self._stems = None  # collected again on next play
         logger.info(f"Added track: {name}")
 
+    def _resample(self, data: np.ndarray, samplerate: int) -> np.ndarray:
+        """Linearly resample (n_samples, channels) audio to the mixer frequency"""
+        n_out = round(len(data) * self.frequency / samplerate)
+        t_in = np.arange(len(data)) / samplerate
+        t_out = np.arange(n_out) / self.frequency
+        return np.stack([np.interp(t_out, t_in, data[:, c]) for c in range(data.shape[1])], axis=1).astype(data.dtype)
+
+    def _prepare(self):
+        """Collect the tracks in index order for the audio callback"""
+        stems = tuple(np.asarray(self.tracks[name]) for name in self._names)
+        self._length = max(len(data) for data in stems)
+        # playback fades in from silence
+        self._gains = np.zeros(len(stems), dtype=np.float32)
+        # compile the kernel now rather than on the first audio block
+        _mix_block(np.zeros((1, self.channels), dtype=np.float32), stems, self._gains, self._targets, 0, 0)
+        self._stems = stems
+
+    def _callback(self, outdata, frames, time, status):
+        """Audio thread: write the next block of the gain-weighted sum of all tracks"""
+        stems = self._stems
+        if stems is None or self._status != PlaybackStatus.PLAYING:
+            outdata.fill(0)
+            return
+        pos = self._pos
+        seek = self._seek
+        if seek is not None:
+            self._seek = None
+            pos = seek
+        n = max(0, min(frames, self._length - pos))  # n < frames past the end of the song
+        _mix_block(outdata, stems, self._gains, self._targets, pos, n)
+        self._pos = pos + n
+
     def play(self):
         """Play all tracks from their current state (if stopped, start)."""
         # only play 'original' if it exists, others are muted but still play in sync
         if self.status != PlaybackStatus.PLAYING:
-            for name, track in self.tracks.items():
-                volume = 1.0 if name == ORIGINAL else 0.0
-                track.channel.set_volume(volume)
-                if not track.channel.get_busy():
-                    track.channel.play(track.sound, loops=0)
+            if self._stems is None and self.tracks:
+                self._prepare()
+            self._vol_vec[:] = 0.0
+            if self._original is not None:
+                self._vol_vec[self._original] = 1.0
+            self._muted_mask = self._stem_mask
+            self._publish()
+            if self._stream.stopped:
+                self._stream.start()
             self.status = PlaybackStatus.PLAYING
             logger.info("Playback started")
 
     def pause(self):
         """Pause all tracks."""
-        for track in self.tracks.values():
-            track.channel.pause()
+        self._stream.stop()
         self.status = PlaybackStatus.PAUSED
         logger.info("Playback paused")
-    
+
     def resume(self):
         """Resume all paused tracks."""
-        for track in self.tracks.values():
-            track.channel.unpause()
+        if self._stream.stopped:
+            self._stream.start()
         self.status = PlaybackStatus.PLAYING
         logger.info("Playback resumed")
 
     def stop(self):
-        """Stop (pause) all tracks."""
-        for track in self.tracks.values():
-            track.channel.stop()
+        """Stop all tracks, the next play starts from the beginning."""
+        self._stream.stop()
+        self._pos = 0
         self.status = PlaybackStatus.STOPPED
         logger.info("Playback stopped")
-    
+
     def is_muted(self, name):
         # since the original track contains all stems, a track is muted if both it and the original are muted
         assert name in self.tracks, f"Track not found: {name}"
-        assert ORIGINAL in self.tracks, "Original track not found"
-        track_muted = self.tracks[name].channel.get_volume() == 0.0
-        original_muted = self.tracks[ORIGINAL].channel.get_volume() == 0.0
-        return track_muted and original_muted
-    
+        assert self._original is not None, "Original track not found"
+        bits = 1 << self._index[name] | 1 << self._original
+        return self._muted_mask & bits == bits
+
     def mute_stem(self, name):
         if self.is_muted(name):
             logger.warning(f"Track {name} is already muted")
             self.log_volumes()
             return
         logger.info(f"Muting stem: {name}")
-        if not self.is_muted(ORIGINAL):
+        index = self._index[name]
+        if not self._muted_mask & 1 << self._original:
             # if original is unmuted, mute original and unmute all others
-            for n in self.tracks:
-                self._set_muted(n, n == ORIGINAL)
+            for i in range(len(self._names)):
+                self._set_muted_idx(i, i == self._original)
         # then mute the requested stem
-        self._set_muted(name, True)
+        self._set_muted_idx(index, True)
+        self._publish()
         self.log_volumes()
-    
+
     def unmute_stem(self, name):
         if not self.is_muted(name):
             logger.warning(f"Track {name} is already unmuted")
@@ -104,43 +256,52 @@ class TrackMixer:
             return
         logger.info(f"Unmuting stem: {name}")
         # first unmute the requested stem
-        self._set_muted(name, False)
-        if all(not self.is_muted(n) for n in self.tracks if n != ORIGINAL):
+        self._set_muted_idx(self._index[name], False)
+        if not self._muted_mask & self._stem_mask:
             # if all stems are now unmuted, unmute original and mute all others
-            for n in self.tracks:
-                self._set_muted(n, n != ORIGINAL)
+            for i in range(len(self._names)):
+                self._set_muted_idx(i, i != self._original)
+        self._publish()
         self.log_volumes()
-    
+
     def toggle_mute(self, name):
         if self.is_muted(name):
             self.unmute_stem(name)
         else:
             self.mute_stem(name)
 
-    def _set_muted(self, name, muted):
-        assert name in self.tracks, f"Track not found: {name}"
+    def _set_muted_idx(self, index: int, muted: bool):
+        """Mute or unmute the track at index, names are resolved by the public methods"""
         if muted:
-            self.tracks[name].channel.set_volume(0.0)
+            self._muted_mask |= 1 << index
         else:
-            self.tracks[name].channel.set_volume(self.volumes[name])
-    
+            self._muted_mask &= ~(1 << index)
+        self._vol_vec[index] = 0.0 if muted else self._volumes[index]
+
+    def _publish(self):
+        """Hand the gains to the audio callback, picked up on its next block"""
+        # a single attribute store, atomic for the callback thread without a lock
+        self._targets = self._vol_vec.copy()
+
     def set_volume(self, name: str, volume: float):
         """Set volume for a track (0.0 to 1.0)"""
         assert name in self.tracks, f"Track not found: {name}"
         volume = max(0.0, min(1.0, volume))  # clamp between 0 and 1
-        self.volumes[name] = volume
-        
+        index = self._index[name]
+        self._volumes[index] = volume
+
         # Only apply volume if track is not muted
-        if not self.is_muted(name):
-            self.tracks[name].channel.set_volume(volume)
-        
+        if not self._muted_mask & 1 << index:
+            self._vol_vec[index] = volume
+            self._publish()
+
         logger.info(f"Set volume for {name}: {volume}")
-    
+
     def get_volume(self, name: str) -> float:
         """Get volume for a track"""
         assert name in self.tracks, f"Track not found: {name}"
-        return self.volumes[name]
-    
+        return float(self._volumes[self._index[name]])
+
     def adjust_volume(self, name: str, delta: float):
         """Adjust volume by delta amount"""
         current = self.get_volume(name)
@@ -148,40 +309,46 @@ class TrackMixer:
         self.set_volume(name, new_volume)
 
     def log_volumes(self):
-        for name, track in self.tracks.items():
-            volume = track.channel.get_volume()
-            logger.info(f"Volume for {name}: {volume}")
+        logger.info("Volumes: " + ", ".join(f"{name}={gain:.2f}" for name, gain in zip(self._names, self._vol_vec)))
 
     def rewind_all(self):
         """Rewind all tracks (restart everything in sync)."""
-        for track in self.tracks.values():
-            track.channel.stop()
-        for track in self.tracks.values():
-            track.channel.play(track.sound, loops=0)
+        # writing _pos here would be lost if the callback is mid-block, it owns the position
+        self._seek = 0
+        if self._stream.stopped:
+            self._pos = 0
         logger.info("Rewound all tracks")
 
     def list_tracks(self):
         """List all loaded tracks."""
         return list(self.tracks.keys())
-    
+
     @staticmethod
     def from_song(song: Song):
         mixer = TrackMixer()
-        for part, path in song.files.items():
-            if path is not None:
-                mixer.add_track(path, name=part)
+        parts = {part: path for part, path in song.files.items() if path is not None}
+        # libsndfile releases the GIL, so the files are decoded in parallel
+        with ThreadPoolExecutor(max_workers=max(1, len(parts))) as pool:
+            for part, data in zip(parts, pool.map(mixer._decode, parts.values())):
+                mixer._add_decoded(part, data)
         return mixer
 
 if __name__ == "__main__":
     song = Song.from_path(Path("songs") / "VULFPECK_1612")
     mixer = TrackMixer.from_song(song)
     logger.info(f"Loaded tracks: {mixer.list_tracks()}")
+    from keyboard_input import KeyboardInput
+    stems = [track for track in mixer.list_tracks() if track != ORIGINAL]
+    logger.info(f"Press 1-{len(stems)} to toggle {', '.join(stems)} (or 'q' to quit)")
     mixer.play()
-    while True:
-        toggle = input("Enter stem to toggle mute (or 'q' to quit): ")
-        if toggle == 'q':
-            break
-        if toggle in mixer.list_tracks():
-            mixer.toggle_mute(toggle)
+    # single key presses, applied as soon as they are typed rather than on Enter
+    with KeyboardInput() as kb:
+        running = True
+        while running:
+            for char in kb.drain_chars(timeout=1.0):
+                if char in "qQ\x03":
+                    running = False
+                    break
+                if char.isdigit() and 1 <= int(char) <= len(stems):
+                    mixer.toggle_mute(stems[int(char) - 1])
     mixer.stop()
-
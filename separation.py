@@ -0,0 +1,9 @@
+"""Demucs separation constants, kept free of torch so the CLI can import them instantly"""
+
+# htdemucs cannot run on segments longer than the 7.8 s it was trained on
+MAX_SEGMENT = 7
+
+STEMS = ('vocals', 'drums', 'bass', 'other')
+# input format of every demucs v4 model
+SAMPLERATE = 44100
+AUDIO_CHANNELS = 2
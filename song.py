@@ -1,12 +1,21 @@
+import errno
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from dl import download_youtube_audio
+from dl import download_youtube_audio, fetch_youtube_info, stream_youtube_audio
 from tempfile import TemporaryDirectory
-from extract import extract_stems
+from extract import extract_stems, extract_stems_from_pcm, is_up_to_date, stem_paths
 from log import get_logger
+from separation import AUDIO_CHANNELS, SAMPLERATE
 
 logger = get_logger(__name__)
 
 ORIGINAL = 'original'
+# records which video a song directory holds, titles are not unique
+VIDEO_ID_FILE = '.video_id'
+# longer videos are downloaded to disk rather than decoded in memory (~21 MB per minute)
+MAX_STREAM_DURATION = 15 * 60
 
 class Song:
     """
@@ -23,6 +32,8 @@ class Song:
             'vocals': None,
             'other': None,
         }
+        # decoded audio of a streamed original, written by extract_stems
+        self.pcm: bytearray | None = None
         if not self.path.exists():
             logger.info(f"Creating song directory at {self.path}")
             self.path.mkdir(parents=True)
@@ -34,34 +45,109 @@ class Song:
         ext = file_path.suffix
         new_file_path = self.path / f"{file_type}{ext}"
         logger.info(f"Moving {file_path} to {new_file_path}")
-        file_path.rename(new_file_path)
+        try:
+            os.replace(file_path, new_file_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # the temporary directory is on another filesystem (e.g. tmpfs): copy then delete
+            shutil.move(file_path, new_file_path)
         self.files[file_type] = new_file_path
     
-    def extract_stems(self):
-        if self.files[ORIGINAL] is None:
+    def extract_stems(self, device: str | None = None, segment: int | None = None,
+                      shifts: int = 1, overlap: float = 0.25, half: bool = False):
+        if self.files[ORIGINAL] is None and self.pcm is None:
             raise ValueError("Original file not set.")
+        if self.files[ORIGINAL] is not None:
+            stems = stem_paths(self.path)
+            if is_up_to_date(stems.values(), self.files[ORIGINAL]):
+                logger.info(f"Stems in {self.path} are up to date, skipping extraction")
+                self.files.update(stems)
+                return
+        options = {"device": device, "segment": segment, "shifts": shifts, "overlap": overlap, "half": half}
         with TemporaryDirectory() as tmpdir:
-            logger.info(f"Extracting stems from {self.files[ORIGINAL]}")
-            stems = extract_stems(self.files[ORIGINAL], Path(tmpdir)) # type: ignore
+            if self.pcm is not None:
+                logger.info(f"Extracting stems from streamed audio of {self.title}")
+                stems = extract_stems_from_pcm(self.pcm, Path(tmpdir), self.title, **options)
+                self.pcm = None
+            else:
+                logger.info(f"Extracting stems from {self.files[ORIGINAL]}")
+                stems = extract_stems(self.files[ORIGINAL], Path(tmpdir), **options) # type: ignore
             logger.info(f"Extracted stems: {stems}")
             logger.info(f"Moving stems to {self.path}")
-            for stem, path in stems.items():
-                self.add_file(stem, path)
+            download = self.files[ORIGINAL]
+            # moves across filesystems are copies, run them side by side
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                for moved in [pool.submit(self.add_file, stem, path) for stem, path in stems.items()]:
+                    moved.result()
+            if download is not None and self.files[ORIGINAL] != download:
+                # the compressed download was decoded to a wav original
+                logger.info(f"Removing {download}")
+                download.unlink()
     
     @staticmethod
-    def from_yt_url(youtube_url):
-        with TemporaryDirectory() as tmpdir:
-            logger.info(f"Downloading audio from YouTube URL: {youtube_url}")
-            title, file_path = download_youtube_audio(youtube_url, tmpdir)
-            # normalize title to be filesystem safe
-            title = "".join(c for c in title if c.isalnum() or c in (' ', '_', '-')).rstrip()
-            # remove multiple spaces
-            title = ' '.join(title.split())
-            # replace spaces with underscores
-            title = title.replace(' ', '_')
+    def yt_path(info: dict) -> Path:
+        # song directory of a YouTube video, named after its title
+        title = info.get("title")
+        if not title:
+            raise ValueError("Could not retrieve video title.")
+        # normalize title to be filesystem safe
+        title = "".join(c for c in title if c.isalnum() or c in (' ', '_', '-')).rstrip()
+        # remove multiple spaces
+        title = ' '.join(title.split())
+        # replace spaces with underscores
+        title = title.replace(' ', '_')
+        path = Path(Song.BASE_DIR) / title
+        if Song.video_id(path) not in (None, info["id"]):
+            # another video with the same title owns this directory
+            path = Path(Song.BASE_DIR) / f"{title}_{info['id']}"
+        return path
+
+    @staticmethod
+    def is_separated(path: Path) -> bool:
+        # whether a song directory already holds an original and up to date stems
+        original = path / f"{ORIGINAL}.wav"
+        return original.exists() and is_up_to_date(stem_paths(path).values(), original)
+
+    @staticmethod
+    def streams(info: dict) -> bool:
+        # whether from_yt_url decodes the video into memory rather than downloading it to disk
+        return 0 < (info.get("duration") or 0) <= MAX_STREAM_DURATION
+
+    @staticmethod
+    def from_yt_url(youtube_url, info: dict | None = None):
+        # `info` from fetch_youtube_info saves a second lookup
+        if info is None:
+            info = fetch_youtube_info(youtube_url)
+        video_id = info["id"]
+        path = Song.yt_path(info)
+        title = path.name
+        if (path / f"{ORIGINAL}.wav").exists():
+            logger.info(f"{title} was already downloaded, reusing {path}")
+            # songs downloaded before ids were recorded are adopted by the first matching title
+            (path / VIDEO_ID_FILE).write_text(video_id)
+            return Song.from_path(path)
+        if Song.streams(info):
+            # decode straight into memory, the original is written with the stems
+            _, pcm = stream_youtube_audio(youtube_url, SAMPLERATE, AUDIO_CHANNELS, info)
             song = Song(title)
-            song.add_file(ORIGINAL, Path(file_path))
+            song.pcm = pcm
+        else:
+            with TemporaryDirectory() as tmpdir:
+                logger.info(f"Downloading audio from YouTube URL: {youtube_url}")
+                _, file_path = download_youtube_audio(youtube_url, tmpdir, info)
+                song = Song(title)
+                song.add_file(ORIGINAL, Path(file_path))
+        (song.path / VIDEO_ID_FILE).write_text(video_id)
         return song
+
+    @staticmethod
+    def video_id(path: Path) -> str | None:
+        # id of the YouTube video a song directory was downloaded from, if any
+        try:
+            return (path / VIDEO_ID_FILE).read_text().strip()
+        except FileNotFoundError:
+            return None
     
     @staticmethod
     def from_path(path: Path):
@@ -70,10 +156,12 @@ class Song:
             raise ValueError(f"Path {path} does not exist or is not a directory.")
         title = path.name
         song = Song(title)
+        # one directory read instead of a stat per expected file
+        with os.scandir(path) as entries:
+            names = {entry.name for entry in entries}
         for file_type in song.files.keys():
-            file_path = path / f"{file_type}.wav"
-            if file_path.exists():
-                song.add_file(file_type, file_path)
+            if f"{file_type}.wav" in names:
+                song.add_file(file_type, path / f"{file_type}.wav")
         if song.files['original'] is None:
             raise ValueError(f"Original file not found in {path}.")
         return song